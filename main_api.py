@@ -1,51 +1,104 @@
 import os
-from flask import Flask, jsonify
-from order_assign import process_order_table
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+import orjson
+from flask import Flask, Response, jsonify, request
+from order_assign import invalidate_zones, load_available_riders, load_zones, process_order_table
+
+# Log records are queued by request threads and written out by a listener thread.
+_log_queue = queue.SimpleQueue()
+_log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler())
+# LOG_LEVEL=WARNING drops the per-run info messages in production; unknown names fall back to INFO.
+_log_level = logging.getLevelName(os.getenv("LOG_LEVEL", "INFO").strip().upper())
+logging.basicConfig(
+    level=_log_level if isinstance(_log_level, int) else logging.INFO,
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    handlers=[logging.handlers.QueueHandler(_log_queue)],
+)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+log = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+# One assignment run at a time; overlapping runs would compete for the same pool connections and riders.
+_assign_run_lock = threading.Lock()
+
 @app.route('/')
 def home():
     """Simple API status check."""
     return jsonify({"message": "API is working!"})
 
+@app.route('/zones/reload', methods=['POST'])
+def reload_zones():
+    """API endpoint to drop the cached delivery zones and load them again."""
+    try:
+        invalidate_zones()
+        zones, _ = load_zones()
+        return jsonify({"status": "success", "message": "Delivery zones reloaded.", "zone_count": len(zones)})
+    except Exception as e:
+        log.error("An error occurred: %s", e)
+        return jsonify({"status": "error", "message": f"An error occurred while reloading zones: {str(e)}"})
+
 @app.route('/assign_orders', methods=['GET'])
 def assign_orders():
-    """API endpoint to trigger order assignment for normal and subscribed orders."""
+    """
+    API endpoint to trigger order assignment for normal and subscribed orders.
+    Pass ?render_map=0 (or false/no/off) to skip writing order_assignment_map.html.
+    """
+    if not _assign_run_lock.acquire(blocking=False):
+        return jsonify({"status": "error", "message": "An order assignment run is already in progress."}), 409
     try:
-        print("Starting order assignment for 'tbl_normal_order'...")
-        assigned_normal, not_assigned_normal, list_normal = process_order_table("tbl_normal_order")
+        render_map = request.args.get("render_map", "1").strip().lower() not in ("0", "false", "no", "off")
+
+        # Zones and the rider pool are loaded once and shared by both tables.
+        zones, zone_tree = load_zones()
+        riders = load_available_riders()
+
+        log.info("Starting order assignment for 'tbl_normal_order'...")
+        assigned_normal, not_assigned_normal, list_normal = process_order_table("tbl_normal_order", zones, zone_tree, riders, render_map)
         
-        print("Starting order assignment for 'tbl_subscribe_order'...")
-        assigned_subscribe, not_assigned_subscribe, list_subscribe = process_order_table("tbl_subscribe_order")
+        log.info("Starting order assignment for 'tbl_subscribe_order'...")
+        assigned_subscribe, not_assigned_subscribe, list_subscribe = process_order_table("tbl_subscribe_order", zones, zone_tree, riders, render_map)
 
         all_assigned_orders = list_normal + list_subscribe
         
-        detailed_assignments = []
-        for order in all_assigned_orders:
-            detailed_assignments.append({
+        detailed_assignments = [
+            {
                 "order_id": order["id"],
                 "user_name": order.get("name", "N/A"),
                 #"zone": order.get("zone", "N/A"),
                 "assigned_rider": order.get("assigned_rider_name", "N/A"),
                 "distance": order.get("distance", "N/A"),
                 "eta": order.get("eta", "N/A"),
+                "distance_m": order.get("distance_m"),
+                "eta_s": order.get("eta_s"),
                 "google_maps_link": order.get("route_link", "N/A")
-            })
+            }
+            for order in all_assigned_orders
+        ]
 
         total_assigned = assigned_normal + assigned_subscribe
         total_not_assigned = not_assigned_normal + not_assigned_subscribe
 
-        return jsonify({
+        # The details list can be large, so it is serialized with orjson as compact UTF-8 with sorted keys
+        # (unlike jsonify, non-ASCII is not escaped and debug mode does not pretty-print).
+        return Response(orjson.dumps({
             "status": "success",
-            "message": "Order assignment process completed. Map saved as order_assignment_map.html",
+            "message": "Order assignment process completed."
+                       + (" Map rendering queued for order_assignment_map.html" if render_map else ""),
             "total_assigned": total_assigned,
             "total_not_assigned": total_not_assigned,
             "details": detailed_assignments
-        })
+        }, option=orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY), mimetype="application/json")
     except Exception as e:
-        print(f"An error occurred: {e}")
+        log.error("An error occurred: %s", e)
         return jsonify({"status": "error", "message": f"An error occurred during order assignment: {str(e)}"})
+    finally:
+        _assign_run_lock.release()
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 10000))
@@ -1,33 +1,197 @@
 import os
+import logging
 import time
+import functools
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import mysql.connector
+import mysql.connector.pooling
 import googlemaps
+import requests
+from requests.adapters import HTTPAdapter
 import folium
+from folium.plugins import MarkerCluster
 import json
 import random
+import numpy as np
+import shapely
 from dotenv import load_dotenv
 from shapely.geometry import Point, Polygon
+from shapely.strtree import STRtree
+from collections import OrderedDict, defaultdict
 from datetime import datetime, date
 
 # -------------------- Load Environment --------------------
 load_dotenv()
-gmaps = googlemaps.Client(key=os.getenv("GOOGLE_MAPS_API_KEY"))
+log = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0
+GOOGLE_API_WORKERS = 16
+ORDER_FETCH_CHUNK_SIZE = 512
+ZONES_CACHE_TTL = 300
+
+# One shared keep-alive session, sized so every Google API worker thread can
+# hold its own connection (the requests default keeps only 10 per host).
+_gmaps_session = requests.Session()
+_gmaps_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=GOOGLE_API_WORKERS))
+gmaps = googlemaps.Client(key=os.getenv("GOOGLE_MAPS_API_KEY"), requests_session=_gmaps_session)
+
+# Order tables are interpolated into SQL, so only these names are accepted.
+ORDER_TABLES = ("tbl_normal_order", "tbl_subscribe_order")
+# Paged by id (keyset): each query takes the filter params, then (last_id, limit).
+PENDING_ORDERS_SQL = {
+    "tbl_normal_order": "SELECT * FROM tbl_normal_order WHERE order_status = 0 AND o_type = 'Delivery' "
+                        "AND id > %s ORDER BY id LIMIT %s",
+    "tbl_subscribe_order": "SELECT * FROM tbl_subscribe_order WHERE order_status = 0 AND odate = %s "
+                           "AND id > %s ORDER BY id LIMIT %s",
+}
+ASSIGN_ORDER_SQL = {
+    table: f"UPDATE {table} SET rid = %s, order_status = 1 WHERE id = %s" for table in ORDER_TABLES
+}
+
+GEO_CACHE_PATH = os.getenv("GEO_CACHE_PATH", "geo_cache.db")
+GEO_CACHE_TTL = 48 * 3600
+GEO_MEMORY_CACHE_SIZE = 100_000
 
 # -------------------- Database Connection --------------------
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "25"))
+# Each dispatch worker holds one pooled connection for its order; one connection
+# is left for the short page/product/rejection reads made alongside them.
+ORDER_DISPATCH_WORKERS = max(1, min(int(os.getenv("ORDER_DISPATCH_WORKERS", "16")), DB_POOL_SIZE - 1))
+
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+def _get_db_pool():
+    """Creates the shared MySQL connection pool on first use."""
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                _db_pool = mysql.connector.pooling.MySQLConnectionPool(
+                    pool_name="meal_mover",
+                    pool_size=DB_POOL_SIZE,
+                    pool_reset_session=True,
+                    host=os.getenv("DB_HOST"),
+                    user=os.getenv("DB_USER"),
+                    password=os.getenv("DB_PASSWORD"),
+                    database=os.getenv("DB_NAME"),
+                    connect_timeout=60,
+                    connection_timeout=60
+                )
+    return _db_pool
+
 def get_db_connection():
-    """Establishes and returns a MySQL database connection."""
-    conn = mysql.connector.connect(
-        host=os.getenv("DB_HOST"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
-        database=os.getenv("DB_NAME"),
-        connect_timeout=60,
-        connection_timeout=60
-    )
-    conn.ping(reconnect=True, attempts=3, delay=5)
-    return conn
+    """
+    Returns a pooled MySQL connection.
+    Calling close() on it hands it back to the pool instead of disconnecting.
+    An exhausted pool or a failed reconnect is retried once before giving up.
+    """
+    try:
+        return _get_db_pool().get_connection()
+    except (mysql.connector.errors.PoolError, mysql.connector.errors.InterfaceError) as e:
+        log.warning("Retrying DB connection checkout: %s", e)
+        time.sleep(0.5)
+        return _get_db_pool().get_connection()
+
+# -------------------- Geo Cache --------------------
+_geo_cache_lock = threading.Lock()
+_geo_cache_conn = None
+# In-process LRU in front of SQLite: key -> (value, expires_at).
+_geo_memory = OrderedDict()
+
+def _get_geo_cache():
+    """
+    Opens (once) the SQLite file backing the geocode/distance cache.
+    WAL with synchronous=NORMAL keeps commits from fsyncing on every write;
+    expired rows are purged on open so the file does not grow without bound.
+    """
+    global _geo_cache_conn
+    if _geo_cache_conn is None:
+        conn = sqlite3.connect(GEO_CACHE_PATH, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS geo_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.execute("DELETE FROM geo_cache WHERE expires_at < ?", (time.time(),))
+        conn.commit()
+        _geo_cache_conn = conn
+    return _geo_cache_conn
+
+def _remember(key, value, expires_at):
+    # Caller holds _geo_cache_lock.
+    _geo_memory[key] = (value, expires_at)
+    _geo_memory.move_to_end(key)
+    if len(_geo_memory) > GEO_MEMORY_CACHE_SIZE:
+        _geo_memory.popitem(last=False)
+
+def geo_cache_get(key):
+    """Returns the cached value for a key, or None on a miss or expired entry."""
+    now = time.time()
+    try:
+        with _geo_cache_lock:
+            hit = _geo_memory.get(key)
+            if hit and hit[1] > now:
+                _geo_memory.move_to_end(key)
+                return hit[0]
+            row = _get_geo_cache().execute(
+                "SELECT value, expires_at FROM geo_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row and row[1] > now:
+                value = json.loads(row[0])
+                _remember(key, value, row[1])
+                return value
+    except sqlite3.Error as e:
+        log.warning("Geo cache read failed for '%s': %s", key, e)
+    return None
+
+def geo_cache_set(key, value, ttl=GEO_CACHE_TTL):
+    """Stores a JSON-serializable value in the geo cache with a TTL."""
+    expires_at = time.time() + ttl
+    try:
+        with _geo_cache_lock:
+            _remember(key, value, expires_at)
+            conn = _get_geo_cache()
+            conn.execute(
+                "INSERT OR REPLACE INTO geo_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at)
+            )
+            conn.commit()
+    except sqlite3.Error as e:
+        log.warning("Geo cache write failed for '%s': %s", key, e)
+
+def geo_cached(make_key):
+    """
+    Caches the tuple returned by a Google helper under make_key(*args).
+    Failed lookups (None results) are not cached so they are retried next run.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            key = make_key(*args)
+            cached = geo_cache_get(key)
+            if cached is not None:
+                return tuple(cached)
+            result = func(*args)
+            if result[0] is not None:
+                geo_cache_set(key, result)
+            return result
+        return wrapper
+    return decorator
+
+def _geocode_key(address):
+    return "geo:" + " ".join(address.lower().split())
+
+def _distance_key(origin, destination):
+    # Rounding to 3 decimals (~100 m) lets near-identical coordinates share an entry.
+    o_lat, o_lng = (round(float(c), 3) for c in origin)
+    d_lat, d_lng = (round(float(c), 3) for c in destination)
+    return f"dist2:{o_lat},{o_lng}:{d_lat},{d_lng}"
 
 # -------------------- Google Maps Helpers --------------------
+@geo_cached(_geocode_key)
 def geocode_address(address):
     """Geocodes an address to latitude and longitude."""
     try:
@@ -36,219 +200,369 @@ def geocode_address(address):
             loc = result[0]['geometry']['location']
             return loc['lat'], loc['lng']
     except Exception as e:
-        print(f"Geocode error for address '{address}': {e}")
+        log.warning("Geocode error for address '%s': %s", address, e)
     return None, None
 
+def geocode_addresses(addresses):
+    """
+    Geocodes a batch of addresses, each distinct address only once.
+    Lookups run concurrently; returns {address: (lat, lng)}.
+    """
+    unique = list(dict.fromkeys(addresses))
+    if not unique:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(GOOGLE_API_WORKERS, len(unique))) as executor:
+        return dict(zip(unique, executor.map(geocode_address, unique)))
+
+@geo_cached(_distance_key)
 def get_distance_and_time(origin, destination):
-    """Calculates driving distance and duration between two points."""
+    """
+    Calculates driving distance and duration between two points.
+    Returns (meters, seconds, distance_text, duration_text); the integer fields
+    come straight from the API and the text fields are for display only.
+    """
     try:
         res = gmaps.distance_matrix([origin], [destination], mode="driving")
         if res['rows'][0]['elements'][0]['status'] == 'OK':
             d = res['rows'][0]['elements'][0]
-            return d['distance']['text'], d['duration']['text']
+            return d['distance']['value'], d['duration']['value'], d['distance']['text'], d['duration']['text']
     except Exception as e:
-        print(f"Distance error from {origin} to {destination}: {e}")
-    return None, None
+        log.warning("Distance error from %s to %s: %s", origin, destination, e)
+    return None, None, None, None
+
+def get_distances_and_times(routes):
+    """
+    Runs get_distance_and_time for many (origin, destination) pairs concurrently.
+    Returns a list of (meters, seconds, distance_text, duration_text) aligned with routes.
+    """
+    if not routes:
+        return []
+    with ThreadPoolExecutor(max_workers=min(GOOGLE_API_WORKERS, len(routes))) as executor:
+        return list(executor.map(lambda route: get_distance_and_time(*route), routes))
+
+def equirect_xy_km(lats, lngs, ref_lat):
+    """
+    Projects points onto a flat km grid around ref_lat (equirectangular). Within a
+    city, squared distances on this grid rank points the same as haversine.
+    """
+    kx = EARTH_RADIUS_KM * np.cos(np.radians(ref_lat))
+    return kx * np.radians(lngs), EARTH_RADIUS_KM * np.radians(lats)
 
 def get_direction_link(origin_lat, origin_lng, dest_lat, dest_lng):
     """Generates a Google Maps direction link."""
     return f"https://www.google.com/maps/dir/{origin_lat},{origin_lng}/{dest_lat},{dest_lng}/"
 
 # -------------------- Zones & Routes --------------------
+# All geometries use shapely's (x, y) = (lng, lat) order.
+_zones_cache = {"loaded_at": 0.0, "value": None}
+_zones_cache_lock = threading.Lock()
+
 def load_zones():
-    """Loads active delivery zones from tbl_delivery_zones."""
+    """
+    Returns (zones, zone_tree), re-reading tbl_delivery_zones at most once per ZONES_CACHE_TTL seconds.
+    The cached polygons and tree are shared by every request until they expire.
+    """
+    with _zones_cache_lock:
+        if _zones_cache["value"] is None or time.time() - _zones_cache["loaded_at"] >= ZONES_CACHE_TTL:
+            _zones_cache["value"] = _load_zones_from_db()
+            _zones_cache["loaded_at"] = time.time()
+        return _zones_cache["value"]
+
+def invalidate_zones():
+    """Drops the cached zones so the next load_zones() call re-reads them."""
+    with _zones_cache_lock:
+        _zones_cache["value"] = None
+
+def _load_zones_from_db():
+    """
+    Loads active delivery zones from tbl_delivery_zones.
+    Polygons are prepared in place so repeated containment tests reuse their edge index.
+    Returns the zone list and an STRtree over their polygons (same order).
+    """
     conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
+    cursor = conn.cursor()
     cursor.execute("SELECT id, zone_name, zone_data FROM tbl_delivery_zones WHERE is_active = 1")
-    zones = []
-    for row in cursor.fetchall():
+    zones, rings = [], []
+    for zone_id, zone_name, raw_zone_data in cursor.fetchall():
         try:
-            zone_data = json.loads(row['zone_data'])
+            zone_data = json.loads(raw_zone_data)
             if zone_data.get('type') == 'polygon':
-                coords = [(c[1], c[0]) for c in zone_data['coordinates']]
-                zones.append({'id': row['id'], 'title': row['zone_name'], 'polygon': Polygon(coords)})
+                # Stored as [lng, lat], which is already the (x, y) order used here.
+                coords = np.asarray(zone_data['coordinates'], dtype=float)
+                if coords.ndim != 2 or coords.shape[1] < 2:
+                    raise ValueError("vertices must be [lng, lat] pairs")
+                coords = coords[:, :2]
+                if len(coords) < 3:
+                    raise ValueError("a polygon needs at least 3 points")
+                if not np.array_equal(coords[0], coords[-1]):
+                    coords = np.vstack([coords, coords[:1]])
+                rings.append(coords)
+                zones.append({'id': zone_id, 'title': zone_name})
         except Exception as e:
-            print(f"Error parsing zone {row['zone_name']}: {e}")
+            log.warning("Error parsing zone %s: %s", zone_name, e)
             continue
     cursor.close()
     conn.close()
-    return zones
-
-def find_zone(lat, lng, zones):
-    """Finds the zone a given point is in."""
-    point = Point(lat, lng)
-    for z in zones:
-        if z['polygon'].contains(point):
-            return z['id'], z['title']
-    return None, None
 
-def load_active_routes():
-    """Loads active rider routes from tbl_rider_routes."""
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    try:
-        cursor.execute("SELECT * FROM tbl_rider_routes WHERE is_active = 1")
-        routes = cursor.fetchall()
-        return routes
-    except Exception as e:
-        print(f"Error loading routes: {e}")
-        return []
-    finally:
-        cursor.close()
-        conn.close()
+    # All polygons are built (and prepared) in one GEOS call from a flat coordinate array.
+    ring_offsets = np.cumsum([0] + [len(r) for r in rings])
+    polygons = shapely.from_ragged_array(
+        shapely.GeometryType.POLYGON,
+        np.concatenate(rings) if rings else np.empty((0, 2)),
+        (ring_offsets, np.arange(len(rings) + 1)),
+    )
+    shapely.prepare(polygons)
+    for zone, polygon in zip(zones, polygons):
+        zone['polygon'] = polygon
+    return zones, STRtree(polygons)
 
-def find_riders_on_route(order_location, routes):
-    """Finds riders whose routes include the order location."""
-    on_route_riders = []
-    order_point = Point(order_location)
-    for r in routes:
-        try:
-            route_data = json.loads(r['route_data'])
-            if route_data['type'] == 'Polygon':
-                route_polygon = Polygon(route_data['coordinates'][0])
-                if route_polygon.contains(order_point):
-                    on_route_riders.append(r['rider_id'])
-        except Exception as e:
-            print(f"Error processing route data for rider {r['rider_id']}: {e}")
-    return on_route_riders
+def find_zone(lat, lng, zones, zone_tree):
+    """
+    Finds the zone a given point is in.
+    The STRtree prunes by bounding box and runs the exact test in one call;
+    the lowest index wins so overlapping zones resolve in load order.
+    """
+    hits = zone_tree.query(Point(lng, lat), predicate="within")
+    if len(hits):
+        z = zones[hits.min()]
+        return z['id'], z['title']
+    return None, None
 
-def get_rejected_riders(order_id):
-    """Gets a list of riders who have rejected this specific order."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+def find_zones(lats, lngs, zones, zone_tree):
+    """
+    Vectorized find_zone for a batch of points.
+    One bulk STRtree query tests every point against the candidate zones in C;
+    the lowest zone index wins, as in find_zone.
+    Returns a list of (zone_id, zone_title) aligned with the inputs.
+    """
+    points = shapely.points(np.asarray(lngs, dtype=float), np.asarray(lats, dtype=float))
+    point_idx, zone_hits = zone_tree.query(points, predicate="within")
+    zone_idx = np.full(len(points), len(zones))
+    np.minimum.at(zone_idx, point_idx, zone_hits)
+    return [(zones[i]['id'], zones[i]['title']) if i < len(zones) else (None, None) for i in zone_idx]
+
+def parse_route_polygon(rider_id, route_data):
+    """
+    Parses a rider's route into a Polygon, or None if it isn't one.
+    Route rings are stored as [lat, lng] pairs and are flipped to (lng, lat).
+    """
     try:
-        cursor.execute("SELECT rider_id FROM tbl_rider_rejections WHERE order_id = %s", (order_id,))
-        return [row[0] for row in cursor.fetchall()]
+        route = json.loads(route_data)
+        if route['type'] == 'Polygon':
+            return Polygon([(p[1], p[0]) for p in route['coordinates'][0]])
     except Exception as e:
-        print(f"Error fetching rejected riders for order {order_id}: {e}")
-        return []
-    finally:
-        cursor.close()
-        conn.close()
+        log.warning("Error processing route data for rider %s: %s", rider_id, e)
+    return None
 
 # -------------------- Rider Helpers --------------------
-def get_available_riders(order_lat, order_lng, order_id, max_distance_km=10):
+def load_available_riders():
     """
-    Finds and sorts available riders, excluding those who have rejected the order.
-    Prioritizes riders whose route covers the order's location.
+    Loads online riders with spare capacity, once per assignment run.
+    Each rider carries its active route polygons, prepared for repeated containment tests.
     """
-    rejected_riders = get_rejected_riders(order_id)
-    on_route_riders = find_riders_on_route((order_lat, order_lng), load_active_routes())
-    
     conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
+    cursor = conn.cursor()
 
-    rejected_riders_tuple = tuple(rejected_riders) if rejected_riders else (0,)
-    
+    # A rider with several active routes comes back once per route. Riders without
+    # a known position are left out, since they cannot be ranked by distance.
     sql_query = """
         SELECT 
             tr.id, 
             tr.title, 
             tra.current_lat AS lats, 
-            tra.current_lng AS longs
+            tra.current_lng AS longs,
+            tra.active_order_count,
+            tra.max_capacity,
+            rr.route_data
         FROM 
             tbl_rider AS tr
         JOIN 
             tbl_rider_availability AS tra ON tr.id = tra.rider_id
+        LEFT JOIN 
+            tbl_rider_routes AS rr ON rr.rider_id = tr.id AND rr.is_active = 1
         WHERE 
             tra.is_online = 1 
             AND tra.is_available = 1 
             AND tra.active_order_count < tra.max_capacity
-            AND tr.id NOT IN ({})
-        ORDER BY 
-            (6371 * acos(
-                cos(radians(%s)) * cos(radians(tra.current_lat)) * cos(radians(tra.current_lng) - radians(%s)) + sin(radians(%s)) * sin(radians(tra.current_lat))
-            )) ASC;
-    """.format(','.join(['%s'] * len(rejected_riders_tuple)))
+            AND tra.current_lat IS NOT NULL
+            AND tra.current_lng IS NOT NULL;
+    """
 
     try:
-        cursor.execute(sql_query, rejected_riders_tuple + (order_lat, order_lng, order_lat))
-        riders = cursor.fetchall()
+        cursor.execute(sql_query)
+        rows = cursor.fetchall()
     except Exception as e:
-        print(f"Error fetching riders from DB: {e}")
-        riders = []
+        log.error("Error fetching riders from DB: %s", e)
+        rows = []
     finally:
         cursor.close()
         conn.close()
 
-    nearby_riders = []
-    for r in riders:
-        on_route = r['id'] in on_route_riders
-        try:
-            dist_text, eta_text = get_distance_and_time(
-                (float(r['lats']), float(r['longs'])),
-                (order_lat, order_lng)
-            )
-            if dist_text:
-                nearby_riders.append({
-                    "id": r["id"],
-                    "title": r["title"],
-                    "distance": dist_text,
-                    "eta": eta_text,
-                    "route_link": get_direction_link(r['lats'], r['longs'], order_lat, order_lng),
-                    "on_route": on_route
-                })
-        except Exception as e:
-            print(f"Error with rider {r['title']}: {e}")
-
-    nearby_riders.sort(key=lambda x: (not x['on_route'], float(x["distance"].replace(" km", "").replace(",", ""))))
-    
-    return nearby_riders
+    # Rows are plain tuples (in SELECT order); one dict is built per rider, not per row.
+    riders = {}
+    for rider_id, title, lats, longs, active_order_count, max_capacity, route_data in rows:
+        rider = riders.get(rider_id)
+        if rider is None:
+            try:
+                float(lats), float(longs)
+            except (TypeError, ValueError):
+                log.warning("Skipping rider %s with invalid location (%r, %r)", rider_id, lats, longs)
+                continue
+            rider = riders[rider_id] = {
+                "id": rider_id,
+                "title": title,
+                "lats": lats,
+                "longs": longs,
+                "active_order_count": active_order_count,
+                "max_capacity": max_capacity,
+                "routes": []
+            }
+        if route_data:
+            polygon = parse_route_polygon(rider_id, route_data)
+            if polygon is not None:
+                shapely.prepare(polygon)
+                rider['routes'].append(polygon)
+    return list(riders.values())
+
+def load_rejections(order_ids):
+    """Maps each order id to the set of rider ids that have rejected it."""
+    rejections = defaultdict(set)
+    if not order_ids:
+        return rejections
 
-def log_assignment(order_id, rider_id, table_name):
-    """Logs a new pending assignment in tbl_rider_assignments."""
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        cursor.execute("""
-            INSERT INTO tbl_rider_assignments (order_id, rider_id, status, assignment_time, order_table)
-            VALUES (%s, %s, %s, NOW(), %s)
-            ON DUPLICATE KEY UPDATE rider_id = %s, status = 'pending', assignment_time = NOW(), response_time = NULL
-        """, (order_id, rider_id, 'pending', table_name, rider_id))
-        conn.commit()
+        cursor.execute(
+            "SELECT order_id, rider_id FROM tbl_rider_rejections WHERE order_id IN ({})".format(
+                ','.join(['%s'] * len(order_ids))
+            ),
+            tuple(order_ids)
+        )
+        for order_id, rider_id in cursor.fetchall():
+            rejections[order_id].add(rider_id)
     except Exception as e:
-        print(f"Error logging assignment: {e}")
+        log.error("Error fetching rider rejections: %s", e)
     finally:
         cursor.close()
         conn.close()
+    return rejections
 
-def insert_rider_notification(rider_id, order_id, table_name, product_details=""):
-    """Inserts a new notification for the rider in tbl_notification."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        msg = f"New Order Available. Please accept Order #{order_id} from table {table_name}. Items: {product_details}"
-        cursor.execute("""
-            INSERT INTO tbl_notification (uid, datetime, title, description, related_id, type) 
-            VALUES (%s, NOW(), %s, %s, %s, %s)
-        """, (rider_id, "New Order Available", msg, order_id, table_name))
-        conn.commit()
-    except Exception as e:
-        print(f"Error inserting rider notification: {e}")
-    finally:
-        cursor.close()
-        conn.close()
+def build_rider_index(riders):
+    """
+    Builds the lookup structures for a rider pool; done once per table, not per order.
+    Holds the riders' coordinates (also pre-projected to km around their mean
+    latitude) and an STRtree over all their route polygons, with route_owner
+    mapping each tree entry back to its rider's position in riders.
+    """
+    routes = [(i, route) for i, r in enumerate(riders) for route in r['routes']]
+    lats = np.fromiter((float(r['lats']) for r in riders), float, len(riders))
+    lngs = np.fromiter((float(r['longs']) for r in riders), float, len(riders))
+    ref_lat = float(lats.mean()) if len(riders) else 0.0
+    x, y = equirect_xy_km(lats, lngs, ref_lat)
+    return {
+        "lats": lats,
+        "lngs": lngs,
+        "ref_lat": ref_lat,
+        "x": x,
+        "y": y,
+        "route_tree": STRtree([route for _, route in routes]),
+        "route_owner": np.fromiter((i for i, _ in routes), np.intp, len(routes)),
+    }
+
+def get_available_riders(order_lat, order_lng, riders, rider_index, rejected_riders=(), max_distance_km=10):
+    """
+    Yields riders from the preloaded pool in ranked order, excluding those who
+    have rejected the order. The ranking is computed once; each rider's dict
+    (and directions link) is only built when the caller asks for the next one. Capacity is not filtered here: it changes while orders
+    are dispatched concurrently, so dispatch_order skips riders that are full
+    at offer time and moves on down the ranking.
+    Prioritizes riders whose route covers the order's location.
+    rider_index is build_rider_index(riders), shared by every order in the table.
+    """
+    eligible = np.flatnonzero(np.fromiter(
+        (r['id'] not in rejected_riders for r in riders),
+        bool, len(riders)
+    ))
+    if not len(eligible):
+        return
+
+    # Rank by (off-route, squared distance on the pre-projected grid) in one
+    # vectorized pass. The whole ranking is available so the offer loop can fall
+    # through it; driving distance is only fetched later, for the rider who accepts.
+    route_hits = rider_index["route_tree"].query(Point(order_lng, order_lat), predicate="within")
+    off_route = ~np.isin(eligible, rider_index["route_owner"][route_hits])
+    order_x, order_y = equirect_xy_km(order_lat, order_lng, rider_index["ref_lat"])
+    dist_sq = (rider_index["x"][eligible] - order_x) ** 2 + (rider_index["y"][eligible] - order_y) ** 2
+    for i in np.lexsort((dist_sq, off_route)):
+        r = riders[eligible[i]]
+        yield {
+            "id": r["id"],
+            "title": r["title"],
+            "lats": r["lats"],
+            "longs": r["longs"],
+            "route_link": get_direction_link(r['lats'], r['longs'], order_lat, order_lng)
+        }
+
+# Dispatch workers share the rider dicts, so capacity is reserved under a lock
+# before an offer goes out and released again if the offer does not stick.
+_rider_capacity_lock = threading.Lock()
+
+def reserve_rider(rider):
+    """Takes one capacity slot on rider; returns False if the rider is already full."""
+    with _rider_capacity_lock:
+        if rider['active_order_count'] >= rider['max_capacity']:
+            return False
+        rider['active_order_count'] += 1
+        return True
+
+def release_rider(rider):
+    """Gives back a slot taken with reserve_rider."""
+    with _rider_capacity_lock:
+        rider['active_order_count'] -= 1
+
+# The write helpers below run on the caller's cursor and do not commit; the
+# caller decides what goes into each transaction.
+def log_assignment(cursor, order_id, rider_id, table_name):
+    """Logs a new pending assignment in tbl_rider_assignments."""
+    cursor.execute("""
+        INSERT INTO tbl_rider_assignments (order_id, rider_id, status, assignment_time, order_table)
+        VALUES (%s, %s, %s, NOW(), %s)
+        ON DUPLICATE KEY UPDATE rider_id = %s, status = 'pending', assignment_time = NOW(), response_time = NULL
+    """, (order_id, rider_id, 'pending', table_name, rider_id))
 
-def get_subscribe_order_products(order_id):
-    """Fetches product details for a subscription order."""
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
+def insert_rider_notification(cursor, rider_id, order_id, table_name, product_details=""):
+    """Inserts a new notification for the rider in tbl_notification."""
+    msg = f"New Order Available. Please accept Order #{order_id} from table {table_name}. Items: {product_details}"
+    cursor.execute("""
+        INSERT INTO tbl_notification (uid, datetime, title, description, related_id, type) 
+        VALUES (%s, NOW(), %s, %s, %s, %s)
+    """, (rider_id, "New Order Available", msg, order_id, table_name))
+
+def load_subscribe_order_products(cursor, order_ids):
+    """Fetches product details for a batch of subscription orders, keyed by order id."""
+    if not order_ids:
+        return {}
+    products_by_oid = defaultdict(list)
     try:
-        cursor.execute("SELECT ptitle, pquantity FROM tbl_subscribe_order_product WHERE oid = %s", (order_id,))
-        products = cursor.fetchall()
-        product_list = [f"{p['pquantity']}x {p['ptitle']}" for p in products]
-        return ", ".join(product_list)
+        cursor.execute(
+            "SELECT oid, ptitle, pquantity FROM tbl_subscribe_order_product WHERE oid IN ({})".format(
+                ','.join(['%s'] * len(order_ids))
+            ),
+            tuple(order_ids)
+        )
+        for oid, ptitle, pquantity in cursor.fetchall():
+            products_by_oid[oid].append(f"{pquantity}x {ptitle}")
     except Exception as e:
-        print(f"Error fetching products for subscribe order {order_id}: {e}")
-        return "N/A"
-    finally:
-        cursor.close()
-        conn.close()
+        log.error("Error fetching products for subscribe orders: %s", e)
+        return {oid: "N/A" for oid in order_ids}
+    return {oid: ", ".join(products_by_oid[oid]) for oid in order_ids}
 
-def simulate_rider_response(order_id, rider_id, table_name):
+def simulate_rider_response(cursor, order_id, rider_id, table_name):
     """
     Simulates rider response (acceptance or rejection)
     For this example, we'll simulate a 90% acceptance rate.
+    Returns (status, reason); the caller logs rejections.
     """
     time.sleep(1) 
     
@@ -257,165 +571,244 @@ def simulate_rider_response(order_id, rider_id, table_name):
     if random.random() < 0.1:
         status = 'rejected'
         reason = "Rider busy"
-        log_rider_rejection(rider_id, order_id, reason)
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("""
-            UPDATE tbl_rider_assignments
-            SET status = %s, response_time = NOW(), response_reason = %s
-            WHERE order_id = %s AND rider_id = %s
-        """, (status, reason, order_id, rider_id))
-        conn.commit()
-    except Exception as e:
-        print(f"Error simulating rider response: {e}")
-    finally:
-        cursor.close()
-        conn.close()
-    return status
-
-def log_rider_rejection(rider_id, order_id, reason):
+    cursor.execute("""
+        UPDATE tbl_rider_assignments
+        SET status = %s, response_time = NOW(), response_reason = %s
+        WHERE order_id = %s AND rider_id = %s
+    """, (status, reason, order_id, rider_id))
+    return status, reason
+
+def log_rider_rejection(cursor, rider_id, order_id, reason):
     """Logs a rider rejection in tbl_rider_rejections."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("""
-            INSERT INTO tbl_rider_rejections (rider_id, order_id, rejection_time, reason)
-            VALUES (%s, %s, NOW(), %s)
-        """, (rider_id, order_id, reason))
-        conn.commit()
-    except Exception as e:
-        print(f"Error logging rejection: {e}")
-    finally:
-        cursor.close()
-        conn.close()
+    cursor.execute("""
+        INSERT INTO tbl_rider_rejections (rider_id, order_id, rejection_time, reason)
+        VALUES (%s, %s, NOW(), %s)
+    """, (rider_id, order_id, reason))
+
+def assign_order(cursor, order, rider_id, table_name):
+    """Finalizes the order assignment in all relevant tables, including the user notification."""
+    cursor.execute(ASSIGN_ORDER_SQL[table_name], (rider_id, order['id']))
+    
+    cursor.execute(
+        "UPDATE tbl_rider_availability SET active_order_count = active_order_count + 1 WHERE rider_id = %s",
+        (rider_id,)
+    )
+    
+    cursor.execute("""
+        INSERT INTO tbl_delivery (store_id, title, status, rider_id, rider_response, response_time)
+        VALUES (%s, 'Home delivery', 1, %s, 'accepted', NOW())
+    """, (order['store_id'], rider_id))
+    
+    now = datetime.now()
+    cursor.execute("""
+        INSERT INTO tbl_rider_performance (rider_id, `date`, `hour`, orders_assigned, orders_accepted)
+        VALUES (%s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE 
+            orders_assigned = orders_assigned + 1,
+            orders_accepted = orders_accepted + 1
+    """, (rider_id, now.date(), now.hour, 1, 1))
+
+    cursor.execute("""
+        INSERT INTO tbl_notification (uid, datetime, title, description)
+        VALUES (%s, NOW(), %s, %s)
+    """, (order['uid'], "Order Assigned!", f"{order.get('name', 'User')}, your Order #{order['id']} has been assigned."))
 
-def assign_order(order, rider_id, table_name):
+# -------------------- Main Logic --------------------
+def fetch_pending_orders(table_name, chunk_size=ORDER_FETCH_CHUNK_SIZE):
     """
-    Finalizes the order assignment in all relevant tables.
-    Uses a transaction to ensure atomicity.
+    Yields the unassigned orders of a table in pages of up to chunk_size rows.
+    Each page is a short keyset query (id > last seen id) on its own connection,
+    so no connection is held while a page is being dispatched.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    params = (date.today().strftime('%Y-%m-%d'),) if table_name == "tbl_subscribe_order" else ()
+    last_id = 0
+    while True:
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(PENDING_ORDERS_SQL[table_name], params + (last_id, chunk_size))
+            chunk = cursor.fetchall()
+        finally:
+            cursor.close()
+            conn.close()
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last_id = chunk[-1]['id']
+
+def dispatch_order(table_name, order, nearby_riders, riders_by_id, product_details=""):
+    """
+    Offers an order to its candidate riders in turn until one accepts.
+    Each offer (pending assignment + rider notification) is committed before the
+    rider's response is awaited, so no transaction stays open during the wait.
+    The response then commits together with its outcome: a rejection with its
+    rejection log, an acceptance with the order's final assignment.
+    A capacity slot is held on each rider while they are offered the order;
+    riders that are already full are skipped.
+    Returns the accepting rider (whose slot is kept) or None.
+    """
+    conn = cursor = None
+    final_rider = None
     try:
-        conn.start_transaction()
-        
-        cursor.execute(f"UPDATE {table_name} SET rid = %s, order_status = 1 WHERE id = %s", (rider_id, order['id']))
-        
-        cursor.execute("UPDATE tbl_rider_availability SET active_order_count = active_order_count + 1 WHERE rider_id = %s", (rider_id,))
-        
-        cursor.execute("""
-            INSERT INTO tbl_delivery (store_id, title, status, rider_id, rider_response, response_time)
-            VALUES (%s, 'Home delivery', 1, %s, 'accepted', NOW())
-        """, (order['store_id'], rider_id))
-        
-        now = datetime.now()
-        cursor.execute("""
-            INSERT INTO tbl_rider_performance (rider_id, `date`, `hour`, orders_assigned, orders_accepted)
-            VALUES (%s, %s, %s, %s, %s)
-            ON DUPLICATE KEY UPDATE 
-                orders_assigned = orders_assigned + 1,
-                orders_accepted = orders_accepted + 1
-        """, (rider_id, now.date(), now.hour, 1, 1))
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        for rider in nearby_riders:
+            if not reserve_rider(riders_by_id[rider['id']]):
+                continue
+            final_rider = rider
+            log_assignment(cursor, order['id'], rider['id'], table_name)
+            insert_rider_notification(cursor, rider['id'], order['id'], table_name, product_details)
+            conn.commit()
 
-        conn.commit()
+            response_status, reason = simulate_rider_response(cursor, order['id'], rider['id'], table_name)
+
+            if response_status == 'accepted':
+                assign_order(cursor, order, rider['id'], table_name)
+                conn.commit()
+                break
+            log_rider_rejection(cursor, rider['id'], order['id'], reason)
+            conn.commit()
+            release_rider(riders_by_id[rider['id']])
+            final_rider = None
     except Exception as e:
-        print(f"Error assigning order in DB: {e}")
-        conn.rollback()
+        # Includes a failed pool checkout (e.g. the pool is exhausted): the order
+        # is left unassigned for the next run instead of aborting the batch.
+        log.error("Error processing order #%s from %s: %s", order['id'], table_name, e)
+        if final_rider:
+            release_rider(riders_by_id[final_rider['id']])
+        final_rider = None
+        if conn is not None:
+            conn.rollback()
     finally:
-        cursor.close()
-        conn.close()
-
-def notify_user(uid, order_id, name):
-    """Inserts a notification for the user in tbl_notification."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+        if cursor is not None:
+            cursor.close()
+        if conn is not None:
+            conn.close()
+    return final_rider
+
+# A single worker keeps renders in submission order, so the last table processed
+# is still the one left in the HTML file.
+_map_render_executor = ThreadPoolExecutor(max_workers=1)
+
+def render_assignment_map(markers, path="order_assignment_map.html"):
+    """Draws the (lat, lng, popup) markers on a folium map and saves it to path."""
     try:
-        cursor.execute("""
-            INSERT INTO tbl_notification (uid, datetime, title, description)
-            VALUES (%s, NOW(), %s, %s)
-        """, (uid, "Order Assigned!", f"{name}, your Order #{order_id} has been assigned."))
-        conn.commit()
+        order_map = folium.Map(location=[18.6, 73.75], zoom_start=12)
+        assignments_layer = MarkerCluster(name="assignments")
+        for lat, lng, popup in markers:
+            folium.Marker(location=[lat, lng], popup=popup, icon=folium.Icon(color="green")).add_to(assignments_layer)
+        order_map.add_child(assignments_layer)
+        order_map.save(path)
     except Exception as e:
-        print(f"Error notifying user: {e}")
-    finally:
-        cursor.close()
-        conn.close()
+        log.error("Error rendering assignment map: %s", e)
 
-# -------------------- Main Logic --------------------
-def process_order_table(table_name):
+def process_order_table(table_name, zones=None, zone_tree=None, riders=None, render_map=True):
     """
-    Processes all unassigned orders in a given table.
+    Processes all unassigned orders in a given table, one fetched chunk at a time.
+    Zones and riders can be preloaded by the caller to share them across tables;
+    rider capacity counts are updated in place as orders are assigned.
+    With render_map, the assignment map is drawn in the background afterwards.
     """
-    zones = load_zones()
-    
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    
-    if table_name == "tbl_subscribe_order":
-        today_date_str = date.today().strftime('%Y-%m-%d')
-        cursor.execute(f"SELECT * FROM {table_name} WHERE order_status = 0 AND odate = %s", (today_date_str,))
-    else:
-        cursor.execute(f"SELECT * FROM {table_name} WHERE order_status = 0 AND o_type = 'Delivery'")
-    
-    orders = cursor.fetchall()
-    cursor.close()
-    conn.close()
+    if table_name not in ORDER_TABLES:
+        raise ValueError(f"Unknown order table: {table_name}")
+    if zones is None or zone_tree is None:
+        zones, zone_tree = load_zones()
+    if riders is None:
+        riders = load_available_riders()
+    rider_index = build_rider_index(riders)
+
+    markers = []
+    assigned_orders = []
+    assigned, not_assigned = 0, 0
 
-    order_map = folium.Map(location=[18.6, 73.75], zoom_start=12)
+    for orders in fetch_pending_orders(table_name):
+        batch_assigned, batch_not_assigned, batch_orders = process_order_batch(
+            table_name, orders, zones, zone_tree, riders, rider_index, markers
+        )
+        assigned += batch_assigned
+        not_assigned += batch_not_assigned
+        assigned_orders.extend(batch_orders)
+
+    # Rendering happens on the map thread so the caller does not wait for it.
+    if render_map:
+        _map_render_executor.submit(render_assignment_map, markers)
+    return assigned, not_assigned, assigned_orders
+
+def process_order_batch(table_name, orders, zones, zone_tree, riders, rider_index, markers):
+    """
+    Assigns riders to one batch of pending orders from a table.
+    Appends a (lat, lng, popup) map marker per assignment to markers and
+    returns (assigned, not_assigned, assigned_orders) for the batch.
+    """
+    riders_by_id = {r['id']: r for r in riders}
+    assignments = []
     assigned_orders = []
     assigned, not_assigned = 0, 0
 
-    for order in orders:
-        full_address = f"{order['address']}, {order['landmark']}"
-        lat, lng = geocode_address(full_address)
+    # Geocode every order first so zones can be resolved for the whole batch at once.
+    addresses = [f"{order['address']}, {order['landmark']}" for order in orders]
+    coords = geocode_addresses(addresses)
+    located = []
+    for order, full_address in zip(orders, addresses):
+        lat, lng = coords[full_address]
         if not lat or not lng:
-            print(f"Skipping Order #{order.get('id', 'N/A')} from {table_name} (Invalid address)")
+            log.warning("Skipping Order #%s from %s (Invalid address)", order.get('id', 'N/A'), table_name)
             continue
+        located.append((order, lat, lng))
 
-        zone_id, zone_title = find_zone(lat, lng, zones)
-
-        nearby_riders = get_available_riders(lat, lng, order['id'])
-        
-        final_rider = None
-        for rider in nearby_riders:
-            log_assignment(order['id'], rider['id'], table_name)
-            
-            product_details = ""
-            if table_name == "tbl_subscribe_order":
-                product_details = get_subscribe_order_products(order['id'])
-
-            insert_rider_notification(rider['id'], order['id'], table_name, product_details)
-            
-            response_status = simulate_rider_response(order['id'], rider['id'], table_name)
-            
-            if response_status == 'accepted':
-                final_rider = rider
-                assign_order(order, final_rider['id'], table_name)
-                break 
+    order_zones = find_zones([lat for _, lat, _ in located], [lng for _, _, lng in located], zones, zone_tree)
+    rejections = load_rejections([order['id'] for order, _, _ in located])
 
+    products = {}
+    if table_name == "tbl_subscribe_order":
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            products = load_subscribe_order_products(cursor, [order['id'] for order, _, _ in located])
+        finally:
+            cursor.close()
+            conn.close()
+
+    # Orders are dispatched concurrently (rider responses are slow); each worker
+    # works on its own connection and commits each offer before awaiting the response.
+    def dispatch(item):
+        (order, lat, lng), (zone_id, zone_title) = item
+        nearby_riders = get_available_riders(lat, lng, riders, rider_index, rejections.get(order['id'], ()))
+        final_rider = dispatch_order(table_name, order, nearby_riders, riders_by_id, products.get(order['id'], ""))
+        return order, final_rider, lat, lng, zone_title
+
+    with ThreadPoolExecutor(max_workers=max(1, min(ORDER_DISPATCH_WORKERS, len(located)))) as executor:
+        results = list(executor.map(dispatch, zip(located, order_zones)))
+
+    for order, final_rider, lat, lng, zone_title in results:
         if final_rider:
-            user_name = order.get('name', 'User') 
-            notify_user(order['uid'], order['id'], user_name)
-
-            folium.Marker(
-                location=[lat, lng],
-                popup=f"Order #{order['id']} → {final_rider['title']}\n{final_rider['distance']}, {final_rider['eta']}",
-                icon=folium.Icon(color="green")
-            ).add_to(order_map)
-
-            order['assigned_rider_name'] = final_rider['title']
-            order['zone'] = zone_title
-            order['distance'] = final_rider['distance']
-            order['eta'] = final_rider['eta']
-            order['route_link'] = final_rider['route_link']
-            assigned_orders.append(order)
-            assigned += 1
+            assignments.append((order, final_rider, lat, lng, zone_title))
         else:
-            print(f"No rider accepted order #{order['id']} from {table_name}.")
+            log.warning("No rider accepted order #%s from %s.", order['id'], table_name)
             not_assigned += 1
 
-    order_map.save("order_assignment_map.html")
-    return assigned, not_assigned, assigned_orders
+    # Driving distance/ETA is display-only, so it is fetched for all assignments at once.
+    distances = get_distances_and_times([
+        ((float(rider['lats']), float(rider['longs'])), (lat, lng))
+        for _, rider, lat, lng, _ in assignments
+    ])
+    for (order, final_rider, lat, lng, zone_title), (meters, seconds, dist_text, eta_text) in zip(assignments, distances):
+        final_rider['distance'] = dist_text or "N/A"
+        final_rider['eta'] = eta_text or "N/A"
+
+        markers.append((lat, lng, f"Order #{order['id']} → {final_rider['title']}\n{final_rider['distance']}, {final_rider['eta']}"))
+
+        order['assigned_rider_name'] = final_rider['title']
+        order['zone'] = zone_title
+        order['distance'] = final_rider['distance']
+        order['eta'] = final_rider['eta']
+        order['distance_m'] = meters
+        order['eta_s'] = seconds
+        order['route_link'] = final_rider['route_link']
+        assigned_orders.append(order)
+        assigned += 1
 
+    return assigned, not_assigned, assigned_orders